@@ -18,6 +18,7 @@ from ghoshtools.ghoshtools import (
     run_func_with_nextflow,
     binary_search_optimal_batch_size,
 )
+from ghoshtools.pipeline import Pipeline, pipeline
 
 # Configure package-level logger.
 _logger = logging.getLogger('ghoshtools')
@@ -62,4 +63,6 @@ __all__ = [
     "CONDA_YML",
     "run_func_with_nextflow",
     "binary_search_optimal_batch_size",
+    "Pipeline",
+    "pipeline",
 ]
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Pilot-run calibration of how many elements each Nextflow task should process."""
+
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import resource
+import tempfile
+import subprocess
+from functools import partial
+
+from ghoshtools import GT_GLOBALS
+from ghoshtools.speculative import kill_process_group
+
+logger = logging.getLogger('ghoshtools')
+
+# Seconds from submission to a task starting, including `conda activate`. Not measurable by a local pilot.
+SCHEDULER_LATENCY_SECONDS = {
+    'day': 60,
+    'ycga': 60,
+    'bigmem': 120,
+    'ycga_bigmem': 120,
+    'scavenge': 120,
+    # Add new partitions here as needed with their latencies
+}
+DEFAULT_SCHEDULER_LATENCY_SECONDS = 60
+
+# Largest share of each task that should be spent on overhead rather than on elements
+TARGET_OVERHEAD_FRACTION = 0.1
+# Batches are kept small enough that the run is still split into at least this many tasks
+MIN_NUM_TASKS = 100
+# Batches are kept small enough to finish well inside the shortest partition time limit in nextflow.config
+MAX_TASK_SECONDS = 4 * 60 * 60
+
+# Limits on each local pilot run, which shares the driver node with everything else
+PILOT_TIMEOUT_SECONDS = 10 * 60
+LOCAL_PILOT_MAX_MEMORY_BYTES = 16 * 1024 ** 3
+
+CALIBRATION_CACHE_FILE_NAME = 'batch_size_calibration.json'
+
+
+def get_func_hash(func_file_path):
+    with open(func_file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_calibration_cache(cache_file_path):
+    if not os.path.exists(cache_file_path):
+        return {}
+    try:
+        with open(cache_file_path, 'r') as f:
+            return json.load(f)
+    except ValueError as e:
+        logger.warn(f"Ignoring unreadable calibration cache {cache_file_path}: {e}")
+        return {}
+
+
+def save_calibration_cache(cache_file_path, cache):
+    # Write then rename so concurrent partitions never read a half-written cache
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, dir=os.path.dirname(cache_file_path), suffix=".json") as f:
+        json.dump(cache, f, indent=4)
+    os.replace(f.name, cache_file_path)
+
+
+def time_pilot_cmd(pilot_cmd, cwd, timeout, max_memory_bytes = None):
+    """
+    Runs a pilot command and returns its wall time in seconds.
+
+    The command runs in its own process group so that a timeout kills everything it started, including Nextflow's
+    cluster jobs. Raises subprocess.TimeoutExpired or subprocess.CalledProcessError with the captured stderr.
+    """
+    def limit_memory():
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+    start_time = time.time()
+    process = subprocess.Popen(pilot_cmd, shell=True, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, start_new_session=True,
+                               preexec_fn=limit_memory if max_memory_bytes else None)
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        raise subprocess.TimeoutExpired(pilot_cmd, timeout, stderr=process.stderr.read())
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, pilot_cmd, stderr=stderr)
+    return time.time() - start_time
+
+
+def time_local_pilot(python_script_file_path, func_file_path, func_name_arg, element_file_paths, timeout):
+    """Runs the Nextflow helper script on the driver on some element files, with a timeout and a memory cap."""
+    pilot_cmd = f"python {python_script_file_path} --pickled_func_file_path {func_file_path} --pickled_obj_file_path {' '.join(element_file_paths)} --return_output False{func_name_arg}"
+    with tempfile.TemporaryDirectory(dir=GT_GLOBALS.SCRATCH_DIR) as pilot_dir_path:
+        return time_pilot_cmd(pilot_cmd, pilot_dir_path, timeout, max_memory_bytes=LOCAL_PILOT_MAX_MEMORY_BYTES)
+
+
+def time_cluster_pilot(make_cluster_pilot_cmd, element_file_paths, timeout):
+    """Runs some element files through Nextflow as a single batched task on the partition of the run."""
+    with tempfile.TemporaryDirectory(dir=GT_GLOBALS.SCRATCH_DIR) as pilot_dir_path:
+        pilot_elements_dir_path = os.path.join(pilot_dir_path, 'elements')
+        os.mkdir(pilot_elements_dir_path)
+        for element_file_path in element_file_paths:
+            os.symlink(element_file_path, os.path.join(pilot_elements_dir_path, os.path.basename(element_file_path)))
+
+        pilot_cmd = make_cluster_pilot_cmd(pilot_elements_dir_path, os.path.join(pilot_dir_path, 'work'), len(element_file_paths))
+        return time_pilot_cmd(pilot_cmd, pilot_dir_path, timeout)
+
+
+def run_pilot(time_pilot, element_file_paths, pilot_size = 3):
+    """
+    Measures per-element compute time and per-task startup time with two pilot runs.
+
+    One run processes a single element and the other processes `pilot_size` elements, so the difference between them
+    is the compute time of the extra elements and what is left over is startup. For a cluster pilot, startup includes
+    scheduler latency.
+
+    :param time_pilot: Callable taking a list of element files and returning the wall time of a pilot run on them.
+    :return: Dictionary with 'per_element_seconds' and 'startup_seconds'.
+    """
+    pilot_file_paths = element_file_paths[:pilot_size]
+    single_seconds = time_pilot(pilot_file_paths[:1])
+    multiple_seconds = time_pilot(pilot_file_paths)
+
+    per_element_seconds = max((multiple_seconds - single_seconds) / (len(pilot_file_paths) - 1), 0.0)
+    startup_seconds = max(single_seconds - per_element_seconds, 0.0)
+    return {'per_element_seconds': per_element_seconds, 'startup_seconds': startup_seconds}
+
+
+def choose_batch_size(num_elements, per_element_seconds, task_overhead_seconds):
+    """
+    Picks the number of elements per task from pilot measurements.
+
+    The batch size is the smallest that keeps overhead under `TARGET_OVERHEAD_FRACTION` of each task, capped so the run
+    still has `MIN_NUM_TASKS` tasks to spread over the cluster and each task stays under `MAX_TASK_SECONDS`.
+
+    :return: Tuple of (batch size, explanation of how it was chosen).
+    """
+    # Guard against elements too fast for the pilot to time
+    per_element_seconds = max(per_element_seconds, 1e-3)
+
+    amortized_batch_size = math.ceil(task_overhead_seconds * (1 - TARGET_OVERHEAD_FRACTION) / (TARGET_OVERHEAD_FRACTION * per_element_seconds))
+    parallel_batch_size = max(1, num_elements // MIN_NUM_TASKS)
+    time_limit_batch_size = max(1, int((MAX_TASK_SECONDS - task_overhead_seconds) // per_element_seconds))
+    batch_size = max(1, min(amortized_batch_size, parallel_batch_size, time_limit_batch_size))
+
+    reason = (f"{per_element_seconds:.2f}s per element, {task_overhead_seconds:.1f}s overhead per task. "
+              f"Amortizing overhead to {TARGET_OVERHEAD_FRACTION:.0%} needs {amortized_batch_size}, "
+              f"keeping {MIN_NUM_TASKS} tasks for {num_elements} elements allows {parallel_batch_size}, "
+              f"staying under {MAX_TASK_SECONDS}s per task allows {time_limit_batch_size}")
+    return batch_size, reason
+
+
+def calibrate_batch_size(python_script_file_path, func_file_path, func_name_arg, element_file_paths, partition, pilot_size = 3, make_cluster_pilot_cmd = None, pilot_timeout = PILOT_TIMEOUT_SECONDS):
+    """
+    Chooses a batch size for a run, running a pilot unless the function was already calibrated.
+
+    By default the pilot runs the helper script on the driver, capped at `pilot_timeout` seconds per run and
+    `LOCAL_PILOT_MAX_MEMORY_BYTES` of memory, and scheduler latency comes from `SCHEDULER_LATENCY_SECONDS`. If
+    `make_cluster_pilot_cmd` is given, the pilot runs on the partition of the run instead, which also measures its
+    scheduler latency. Use the cluster pilot for functions that need more time or memory than the driver has.
+
+    Pilot measurements are cached in the scratch dir by the hash of the extracted function file (and the partition for
+    cluster pilots), so later runs of the same function skip the pilot.
+
+    :param python_script_file_path: Path to the Nextflow helper script.
+    :param func_file_path: Path to the extracted function module.
+    :param func_name_arg: `--func_name` argument for the helper script, or an empty string.
+    :param element_file_paths: Pickled element files of the run. The pilot uses the first `pilot_size` of them.
+    :param partition: Partition the run is going to, used to look up scheduler latency.
+    :param pilot_size: Number of elements in the larger pilot run.
+    :param make_cluster_pilot_cmd: Callable taking (dir_path, work_dir_path, batch_size) and returning a Nextflow
+                                   command that runs the element files in dir_path as one task, or None for a local pilot.
+    :param pilot_timeout: Seconds each of the two pilot runs may take.
+    :return: The chosen batch size, or None if the pilot failed or timed out.
+    """
+    if len(element_file_paths) < 2:
+        return 1
+
+    cache_file_path = os.path.join(GT_GLOBALS.SCRATCH_DIR, CALIBRATION_CACHE_FILE_NAME)
+    cache = load_calibration_cache(cache_file_path)
+    func_hash = get_func_hash(func_file_path)
+    cache_key = func_hash if make_cluster_pilot_cmd is None else f"{func_hash}:{partition}"
+
+    if cache_key in cache:
+        calibration = cache[cache_key]
+        logger.info("Using cached calibration for function hash %s", func_hash[:12])
+    else:
+        if make_cluster_pilot_cmd is None:
+            time_pilot = partial(time_local_pilot, python_script_file_path, func_file_path, func_name_arg, timeout=pilot_timeout)
+        else:
+            time_pilot = partial(time_cluster_pilot, make_cluster_pilot_cmd, timeout=pilot_timeout)
+
+        try:
+            calibration = run_pilot(time_pilot, element_file_paths, pilot_size=max(2, pilot_size))
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            logger.warn("Pilot run failed, falling back to one element per task: %s\n%s", e, e.stderr or '')
+            return None
+
+        cache[cache_key] = calibration
+        save_calibration_cache(cache_file_path, cache)
+        logger.info("Pilot run measured %.2fs per element and %.2fs startup for function hash %s", calibration['per_element_seconds'], calibration['startup_seconds'], func_hash[:12])
+
+    task_overhead_seconds = calibration['startup_seconds']
+    if make_cluster_pilot_cmd is None:
+        task_overhead_seconds += SCHEDULER_LATENCY_SECONDS.get(partition, DEFAULT_SCHEDULER_LATENCY_SECONDS)
+    batch_size, reason = choose_batch_size(len(element_file_paths), calibration['per_element_seconds'], task_overhead_seconds)
+    logger.info("Chose batch size %d on %s: %s", batch_size, partition, reason)
+    return batch_size
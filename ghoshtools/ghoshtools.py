@@ -1,6 +1,7 @@
 """Main module."""
 
 import ast
+import copy
 import tempfile
 from pprint import pprint
 import dill as pickle
@@ -16,8 +17,13 @@ import logging
 import re
 import shutil
 import glob
+import hashlib
+import multiprocessing
 
 from ghoshtools import GT_GLOBALS, utils
+from ghoshtools.speculative import run_nextflow_speculatively
+from ghoshtools.progress import ProgressMonitor, ProgressRelay
+from ghoshtools.calibration import calibrate_batch_size
 from importlib import resources
 
 logger = logging.getLogger('ghoshtools')
@@ -84,6 +90,46 @@ def pickle_dump_iterable(element, temp_iterable_dir_path):
         obj_file_path.flush()
     return obj_file_path.name
 
+def dedupe_iterable(my_iterable):
+    """
+    Removes elements whose serialized form is identical to an earlier element.
+
+    :param my_iterable: Iterable of picklable objects.
+    :return: A tuple of (list of unique elements in order of first appearance, list giving the index into the unique
+             elements for every original element).
+    """
+    unique_elements = []
+    positions = []
+    hash_to_position = {}
+
+    for element in my_iterable:
+        element_hash = hashlib.sha256(pickle.dumps(element)).hexdigest()
+        if element_hash not in hash_to_position:
+            hash_to_position[element_hash] = len(unique_elements)
+            unique_elements.append(element)
+        positions.append(hash_to_position[element_hash])
+
+    return unique_elements, positions
+
+def get_element_name(element_file_path):
+    return os.path.splitext(os.path.basename(element_file_path))[0]
+
+def order_result_file_paths(result_file_paths, element_file_paths):
+    # The helper script prefixes each result file with the name of the element file it was computed from
+    element_positions = {get_element_name(element_file_path): i for i, element_file_path in enumerate(element_file_paths)}
+    ordered_result_file_paths = [None] * len(element_file_paths)
+
+    for result_file_path in result_file_paths:
+        element_name = os.path.basename(result_file_path).split('.')[0]
+        if element_name in element_positions:
+            ordered_result_file_paths[element_positions[element_name]] = result_file_path
+
+    missing_element_names = [get_element_name(element_file_path) for element_file_path, result_file_path in zip(element_file_paths, ordered_result_file_paths) if result_file_path is None]
+    if missing_element_names:
+        raise RuntimeError(f"No result found for {len(missing_element_names)} of {len(element_file_paths)} elements: {', '.join(missing_element_names)}")
+
+    return ordered_result_file_paths
+
 def append_partition_to_log_filename(log_file_path, partition):
     # Split the file path into directory and file name
     dir_name, file_name = os.path.split(log_file_path)
@@ -144,7 +190,7 @@ def split_series_by_weight(series, partition, weighting_dict):
     return split_lists
 
 
-def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day', clear_work_dir = True, return_output = True):
+def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day', clear_work_dir = True, return_output = True, speculative = False, speculative_partition = None, progress_callback = None, progress_bar = False, dedupe = False, batch_size = None, pilot = 'local'):
     """
     Executes a given Python function on an iterable of objects using Nextflow, optionally returning the results.
 
@@ -161,9 +207,28 @@ def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day
       iterable objects. If False, no results are returned. Defaults to True.
     - log_file_path (str, optional): The file path for the Nextflow log file. If not provided, logs are redirected to 
       '/dev/null', effectively discarding them.
+    - speculative (bool, optional): If True, once most elements are done, tasks running much longer than the median 
+      completed task are launched again and whichever copy finishes first is kept. Defaults to False.
+    - speculative_partition (str, optional): Partition to run the speculative duplicates on. Defaults to `partition`.
+    - progress_callback (callable, optional): Called from a background thread of the calling process with a dict of 
+      completed/failed/running counts, elements per second and ETA while Nextflow runs. If `partition` is a list, each 
+      partition reports separately and the dict's 'partition' key says which one.
+    - progress_bar (bool, optional): If True, draws a progress bar on stderr while Nextflow runs. If `partition` is a 
+      list, each partition prints its reports as separate lines instead. Defaults to False.
+    - dedupe (bool, optional): If True, elements that pickle to identical bytes are only dispatched once and their 
+      result is copied back to every original position. Every position gets its own deep copy of the result. Results 
+      are returned as one flat list in input order, even when `partition` is a list. Defaults to False.
+    - batch_size (int or str, optional): Number of elements each Nextflow task processes in one Python process. If 
+      'auto', a local pilot run measures per-element compute time and per-task startup, and the batch size is chosen 
+      to amortize task overhead without giving up parallelism. If the pilot fails or times out, falls back to one 
+      element per task. Defaults to None, one element per task.
+    - pilot (str, optional): Where the `batch_size='auto'` pilot runs. 'local' runs it on the driver with a timeout and 
+      memory cap. 'cluster' submits it to `partition`, for functions too slow or memory hungry for the driver. 
+      Defaults to 'local'.
 
     Returns:
-    - list: A list of results from the function execution if `return_output` is True; otherwise, None.
+    - list: A list of results from the function execution, in the same order as `my_iterable`, if `return_output` is 
+      True; otherwise, None.
 
     Raises:
     - subprocess.CalledProcessError: If the Nextflow command execution fails.
@@ -176,9 +241,10 @@ def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day
     - The function uses global settings from `GT_GLOBALS` for the scratch directory and Conda environment YAML path.
     """
     
-    if clear_work_dir:
-        safe_clear_work_dir()
-        
+    if batch_size is not None and batch_size != 'auto' and not (isinstance(batch_size, int) and not isinstance(batch_size, bool) and batch_size > 0):
+        raise ValueError(f"batch_size must be a positive int, 'auto' or None, not {batch_size!r}")
+    if pilot not in ('local', 'cluster'):
+        raise ValueError(f"pilot must be 'local' or 'cluster', not {pilot!r}")
 
     partition_weighting = {
         'bigmem': 3,
@@ -187,19 +253,68 @@ def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day
         # Add new partitions here as needed with their weightings
     }
 
+    if dedupe:
+        unique_elements, positions = dedupe_iterable(my_iterable)
+        num_saved = len(positions) - len(unique_elements)
+        logger.info("Deduplicated %d elements to %d unique elements. %d fewer elements (%.0f%%) dispatched", len(positions), len(unique_elements), num_saved, 100 * num_saved / len(positions) if positions else 0)
+
+        if isinstance(partition, list):
+            # The fan-out needs one result per unique element, so catch elements the partition split would drop before
+            # running anything on the cluster
+            total_weight = sum(partition_weighting.get(part, 0) for part in partition)
+            num_dispatched = sum(len(chunk) for chunk in split_series_by_weight(pd.Series(unique_elements), partition = partition, weighting_dict = partition_weighting)) if total_weight else 0
+            if num_dispatched != len(unique_elements):
+                raise ValueError(f"Splitting {len(unique_elements)} unique elements across {partition} dispatches {num_dispatched} of them, so results cannot be matched back to the input. "
+                                 f"Check that every partition has a weighting in partition_weighting")
+
+        results = run_func_with_nextflow(my_func, unique_elements, log_file_path, partition=partition, clear_work_dir=clear_work_dir, return_output=return_output, speculative=speculative, speculative_partition=speculative_partition, progress_callback=progress_callback, progress_bar=progress_bar, batch_size=batch_size, pilot=pilot)
+        if not return_output:
+            return
+        if isinstance(partition, list):
+            # Partitions are split in order, so their concatenated results line up with the unique elements as long as
+            # split_series_by_weight did not drop any
+            results = [result for partition_results in results for result in partition_results]
+        if len(results) != len(unique_elements):
+            raise RuntimeError(f"Got {len(results)} results for {len(unique_elements)} unique elements, so they cannot be matched back to the input. "
+                               f"Check that every partition in {partition} has a weighting and received its share of elements")
+        # Each position gets its own copy, as it would without dedupe, so mutating one result does not change its duplicates
+        fanned_out_results = []
+        used_positions = set()
+        for position in positions:
+            fanned_out_results.append(copy.deepcopy(results[position]) if position in used_positions else results[position])
+            used_positions.add(position)
+        return fanned_out_results
+
+    if clear_work_dir:
+        safe_clear_work_dir()
+        
+
     if isinstance(partition, list):
         weighted_iterable = []
         chunked_iterable = split_series_by_weight(pd.Series(my_iterable), partition = partition, weighting_dict = partition_weighting)
         pprint(chunked_iterable)
             
-        with ProcessPoolExecutor() as executor:
-            futures = []
-            for part, chunk_iter in zip(partition, chunked_iterable):
-                future = executor.submit(run_func_with_nextflow, my_func, chunk_iter, log_file_path, partition=part, clear_work_dir=False, return_output=return_output)
-                futures.append(future)
-            
-            # If you need to process results
-            results = [future.result() for future in futures]
+        relay = None
+        if progress_callback is not None:
+            # Partitions run in child processes, so their progress is sent back to call the callback in the driver
+            manager = multiprocessing.Manager()
+            progress_queue = manager.Queue()
+            relay = ProgressRelay(progress_queue, progress_callback)
+            relay.start()
+
+        try:
+            with ProcessPoolExecutor() as executor:
+                futures = []
+                for part, chunk_iter in zip(partition, chunked_iterable):
+                    future = executor.submit(run_func_with_nextflow, my_func, chunk_iter, log_file_path, partition=part, clear_work_dir=False, return_output=return_output, speculative=speculative, speculative_partition=speculative_partition, progress_callback=progress_queue.put if relay is not None else None, progress_bar='lines' if progress_bar else False, batch_size=batch_size, pilot=pilot)
+                    futures.append(future)
+                
+                # If you need to process results
+                results = [future.result() for future in futures]
+        finally:
+            if relay is not None:
+                relay.stop()
+                manager.shutdown()
         return results
 
 
@@ -215,28 +330,68 @@ def run_func_with_nextflow(my_func, my_iterable, log_file_path, partition = 'day
     with tempfile.NamedTemporaryFile(mode="wb", delete=False, dir=GT_GLOBALS.SCRATCH_DIR, suffix=".py") as func_file_path:
         # pickle.dump(my_func, func_file_path)
         # func_file_path.flush()
-        # TODO: Assumes that all methods in this file have different names
-        python_cmd = f"python /home/rg972/project/GhoshTools/ghoshtools/extract_method.py --input {my_func.__code__.co_filename} --func_name {my_func.__name__} --output {func_file_path.name}"
-        utils.run_shell_command(python_cmd)
+        if hasattr(my_func, 'write_worker_module'):
+            # Fused pipeline stages write their own worker module and name its entry point
+            func_name = my_func.write_worker_module(func_file_path.name)
+        else:
+            # TODO: Assumes that all methods in this file have different names
+            python_cmd = f"python /home/rg972/project/GhoshTools/ghoshtools/extract_method.py --input {my_func.__code__.co_filename} --func_name {my_func.__name__} --output {func_file_path.name}"
+            utils.run_shell_command(python_cmd)
+            func_name = None
+        func_name_arg = f" --func_name {func_name}" if func_name else ''
         
         with tempfile.TemporaryDirectory(dir=GT_GLOBALS.SCRATCH_DIR) as temp_iterable_dir_path:
             with ProcessPoolExecutor() as executor:
-                executor.map(partial(pickle_dump_iterable, temp_iterable_dir_path = temp_iterable_dir_path), my_iterable)
+                element_file_paths = list(executor.map(partial(pickle_dump_iterable, temp_iterable_dir_path = temp_iterable_dir_path), my_iterable))
                 logger.info("%d elements from iterable were pickled", len(my_iterable))
                 
                 with resources.path('ghoshtools', 'work') as work_dir_path:
                     work_dir_path = os.path.join(GT_GLOBALS.SCRATCH_DIR, '../work')
                     # TODO: If multiple calls to this work directory are made at the same time, the files will be overwritten.
                     
-                    with resources.path('ghoshtools.resources', 'run_python_function.nf') as nextflow_script_file_path:
-                        with resources.path('ghoshtools.resources', 'nextflow_helper_script.py') as python_script_file_path:                              
-                            nextflow_cmd = f"nextflow -log {log_file_path} run {nextflow_script_file_path} --return_output {return_output} --python_path {python_script_file_path} --file_path {func_file_path.name} --dir_path {temp_iterable_dir_path} -w {work_dir_path} -profile {partition}"
+                    with resources.path('ghoshtools.resources', 'nextflow_helper_script.py') as python_script_file_path:
+                        if batch_size == 'auto':
+                            make_cluster_pilot_cmd = None
+                            if pilot == 'cluster':
+                                def make_cluster_pilot_cmd(dir_path, pilot_work_dir_path, pilot_batch_size):
+                                    with resources.path('ghoshtools.resources', 'run_python_function_batched.nf') as batched_script_file_path:
+                                        return f"nextflow -log /dev/null run {batched_script_file_path} --return_output False --python_path {python_script_file_path} --file_path {func_file_path.name} --dir_path {dir_path}{func_name_arg} --batch_size {pilot_batch_size} -w {pilot_work_dir_path} -profile {partition}"
+
+                            batch_size = calibrate_batch_size(python_script_file_path, func_file_path.name, func_name_arg, element_file_paths, partition, make_cluster_pilot_cmd=make_cluster_pilot_cmd)
+                        nextflow_script_name = 'run_python_function_batched.nf' if batch_size else 'run_python_function.nf'
+                        batch_size_arg = f" --batch_size {batch_size}" if batch_size else ''
+                        
+                        with resources.path('ghoshtools.resources', nextflow_script_name) as nextflow_script_file_path:
+                            def make_nextflow_cmd(dir_path, work_dir_path, partition, log_file_path):
+                                return f"nextflow -log {log_file_path} run {nextflow_script_file_path} --return_output {return_output} --python_path {python_script_file_path} --file_path {func_file_path.name} --dir_path {dir_path}{func_name_arg}{batch_size_arg} -w {work_dir_path} -profile {partition}"
+
+                            nextflow_cmd = make_nextflow_cmd(temp_iterable_dir_path, work_dir_path, partition, log_file_path)
                             print(nextflow_cmd)
                             os.system(f"echo {nextflow_cmd} > /home/rg972/project/nextflow_command.txt")
-                            result = subprocess.run(nextflow_cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                            
+                            monitor = None
+                            if progress_callback is not None or progress_bar:
+                                monitor = ProgressMonitor(element_file_paths, work_dir_path, partition, callback=progress_callback, progress_bar=progress_bar)
+                                monitor.start()
+                            
+                            try:
+                                if speculative:
+                                    def make_speculative_cmd(dir_path, speculative_work_dir_path, wave):
+                                        speculative_log_file_path = log_file_path if log_file_path == '/dev/null' else append_partition_to_log_filename(log_file_path, f"speculative{wave}")
+                                        return make_nextflow_cmd(dir_path, speculative_work_dir_path, speculative_partition or partition, speculative_log_file_path)
+
+                                    task_dirs = run_nextflow_speculatively(nextflow_cmd, element_file_paths, work_dir_path, make_speculative_cmd)
+                                    result_file_paths = [result_file_path for element_file_path, task_dir in zip(element_file_paths, task_dirs) for result_file_path in glob.glob(os.path.join(task_dir, f"{get_element_name(element_file_path)}.*.pkl"))]
+                                else:
+                                    result = subprocess.run(nextflow_cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                                    result_file_paths = convert_nf_output_to_list_of_pickle_files(result.stdout)
+                            finally:
+                                if monitor is not None:
+                                    progress = monitor.stop()
+                                    logger.info("%d of %d elements completed, %d failed in %ds", progress['completed'], progress['total'], progress['failed'], progress['elapsed_seconds'])
                             
                             if return_output:
-                                results = [load_pickle_obj_from_file(result_file_path) for result_file_path in convert_nf_output_to_list_of_pickle_files(result.stdout)]
+                                results = [load_pickle_obj_from_file(result_file_path) for result_file_path in order_result_file_paths(result_file_paths, element_file_paths)]
                                 logger.info("Nextflow run complete. %d results generated. Log file available at %s", len(results), log_file_path)
                                 return results
                             
@@ -0,0 +1,153 @@
+"""Fused multi-stage pipelines that run chained functions in a single Nextflow task."""
+
+import tempfile
+import logging
+from collections import OrderedDict
+from functools import reduce as functools_reduce
+
+from ghoshtools import GT_GLOBALS
+from ghoshtools.extract_method import extract_and_rewrite
+from ghoshtools.ghoshtools import run_func_with_nextflow
+
+logger = logging.getLogger('ghoshtools')
+
+WORKER_FUNC_NAME = 'gt_pipeline_worker'
+
+# Stage kinds that run inside the worker. Anything else is a stage boundary handled on the driver.
+FUSED_STAGE_KINDS = ('map', 'filter')
+
+# Marks a reduce without an initial value, so that None can still be used as one
+_NO_INITIAL = object()
+
+
+class FusedStages:
+    """
+    A run of map/filter stages that is shipped to Nextflow as one worker module.
+
+    Each element passes through every stage in-process. The worker returns a list of outputs so that
+    elements dropped by a filter simply come back empty.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.__name__ = '_'.join(func.__name__ for _, func in stages)
+
+    def write_worker_module(self, output_file_path):
+        # Extract each distinct stage function once, the same way run_func_with_nextflow does for a single function
+        func_sources = OrderedDict()
+        for _, func in self.stages:
+            if func.__name__ == '<lambda>':
+                raise ValueError("Pipeline stages must be named functions, lambdas cannot be extracted")
+            if func.__name__ in func_sources:
+                existing_func, _ = func_sources[func.__name__]
+                if func is existing_func:
+                    continue
+                raise ValueError(f"Pipeline stages {existing_func.__module__}.{func.__name__} and {func.__module__}.{func.__name__} share a name, rename one of them")
+
+            with tempfile.NamedTemporaryFile(mode="w", dir=GT_GLOBALS.SCRATCH_DIR, suffix=".py") as stage_file_path:
+                extract_and_rewrite(func.__code__.co_filename, func.__name__, stage_file_path.name)
+                with open(stage_file_path.name, 'r') as f:
+                    func_sources[func.__name__] = (func, f.read())
+
+        worker_lines = [f"def {WORKER_FUNC_NAME}(element):\n", "    outputs = [element]\n"]
+        for kind, func in self.stages:
+            if kind == 'map':
+                worker_lines.append(f"    outputs = [{func.__name__}(x) for x in outputs]\n")
+            elif kind == 'filter':
+                worker_lines.append(f"    outputs = [x for x in outputs if {func.__name__}(x)]\n")
+        worker_lines.append("    return outputs\n")
+
+        with open(output_file_path, 'w') as output_file:
+            output_file.writelines([source for _, source in func_sources.values()] + ['\n'] + worker_lines)
+
+        logger.info("Fused %d stages (%s) into worker module %s", len(self.stages), self.__name__, output_file_path)
+        return WORKER_FUNC_NAME
+
+
+class Pipeline:
+    """
+    Chain of functions applied to every element of an iterable.
+
+    Consecutive map/filter stages are fused and run inside a single Nextflow task per element, so intermediates
+    are never written to scratch or loaded back into the driver. `group_by` and `reduce` need to see every element
+    and are the only places where the pipeline waits for the cluster and collects results.
+
+    Example:
+        gt.pipeline(f).map(g).filter(h).run(my_iterable, log_file_path)
+    """
+
+    def __init__(self, stages = None):
+        self.stages = list(stages) if stages is not None else []
+
+    def _with_stage(self, kind, func, *args):
+        if self.stages and self.stages[-1][0] == 'reduce':
+            raise ValueError("No stages can be added after reduce")
+        return Pipeline(self.stages + [(kind, func) + args])
+
+    def map(self, func):
+        return self._with_stage('map', func)
+
+    def filter(self, func):
+        return self._with_stage('filter', func)
+
+    def group_by(self, key_func):
+        """Shuffle boundary. The next stages receive (key, [elements]) tuples in order of first appearance."""
+        return self._with_stage('group_by', key_func)
+
+    def reduce(self, func, initial = _NO_INITIAL):
+        """Reduce boundary. Applied on the driver to the collected results of the preceding stages."""
+        return self._with_stage('reduce', func, initial)
+
+    def split_stages(self):
+        """Split the stages into fused worker segments separated by driver-side boundaries."""
+        segments = []
+        current_segment = []
+        for stage in self.stages:
+            if stage[0] in FUSED_STAGE_KINDS:
+                current_segment.append(stage)
+                continue
+            if current_segment:
+                segments.append(FusedStages(current_segment))
+                current_segment = []
+            segments.append(stage)
+        if current_segment:
+            segments.append(FusedStages(current_segment))
+        return segments
+
+    def run(self, my_iterable, log_file_path, partition = 'day', clear_work_dir = True):
+        """
+        Runs the pipeline on an iterable using Nextflow.
+
+        Parameters:
+        - my_iterable (iterable): Objects to push through the pipeline. Each should be serializable with pickle.
+        - log_file_path (str): Nextflow log file path, passed to `run_func_with_nextflow` for every fused segment.
+        - partition (str or list, optional): Partition(s) to run the fused segments on. Defaults to 'day'.
+        - clear_work_dir (bool, optional): Clear the work dir before the first segment. Defaults to True.
+
+        Returns:
+        - list: The pipeline outputs, or the reduced value if the pipeline ends with `reduce`.
+        """
+        elements = list(my_iterable)
+        for segment in self.split_stages():
+            if isinstance(segment, FusedStages):
+                results = run_func_with_nextflow(segment, elements, log_file_path, partition=partition, clear_work_dir=clear_work_dir, return_output=True)
+                clear_work_dir = False
+                if isinstance(partition, list):
+                    # One list of results per partition
+                    results = [result for partition_results in results for result in partition_results]
+                elements = [output for outputs in results for output in outputs]
+            elif segment[0] == 'group_by':
+                groups = OrderedDict()
+                for element in elements:
+                    groups.setdefault(segment[1](element), []).append(element)
+                elements = list(groups.items())
+            elif segment[0] == 'reduce':
+                _, func, initial = segment
+                elements = functools_reduce(func, elements) if initial is _NO_INITIAL else functools_reduce(func, elements, initial)
+            logger.info("Pipeline segment %s complete", getattr(segment, '__name__', segment[0]))
+        return elements
+
+
+def pipeline(func):
+    """Starts a pipeline whose first stage maps `func` over every element."""
+    return Pipeline().map(func)
@@ -0,0 +1,144 @@
+"""Live progress, throughput and ETA reporting for Nextflow runs."""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from ghoshtools.speculative import get_task_state, update_task_dir_elements
+
+logger = logging.getLogger('ghoshtools')
+
+PROGRESS_BAR_WIDTH = 30
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def format_progress_bar(progress):
+    total = progress['total']
+    filled = int(PROGRESS_BAR_WIDTH * progress['completed'] / total) if total else PROGRESS_BAR_WIDTH
+    bar = '#' * filled + '.' * (PROGRESS_BAR_WIDTH - filled)
+    return (f"[{progress['partition']}] [{bar}] {progress['completed']}/{total} completed, {progress['failed']} failed, "
+            f"{progress['running']} running | {progress['elements_per_second']:.2f} el/s | ETA {format_seconds(progress['eta_seconds'])}")
+
+
+class ProgressMonitor(threading.Thread):
+    """
+    Background thread that watches the Nextflow task dirs of a run and reports its progress.
+
+    Every `poll_interval` seconds a progress dict is passed to `callback` and, if `progress_bar` is True, drawn on
+    stderr. With `progress_bar='lines'` every report is printed on a new line, for runs where several partitions
+    report to the same terminal. The dict has the keys partition, total, completed, failed, running, pending, elapsed_seconds,
+    elements_per_second and eta_seconds. Counts are per element, so retries and speculative duplicates of the same
+    element are only counted once.
+    """
+
+    def __init__(self, element_file_paths, work_dir_path, partition, callback = None, progress_bar = False, poll_interval = 10):
+        super().__init__(daemon=True)
+        self.element_names = {os.path.basename(element_file_path) for element_file_path in element_file_paths}
+        self.work_dir_paths = [work_dir_path, os.path.join(work_dir_path, 'speculative')]
+        self.partition = partition
+        self.callback = callback
+        self.progress_bar = progress_bar
+        self.poll_interval = poll_interval
+        self.task_dir_elements = {}
+        self.start_time = time.time()
+        self._stop_event = threading.Event()
+
+    def get_progress(self):
+        for path in self.work_dir_paths:
+            update_task_dir_elements(path, self.element_names, self.task_dir_elements)
+
+        states = {}
+        for task_dir, staged_element_names in list(self.task_dir_elements.items()):
+            try:
+                state, _ = get_task_state(task_dir)
+            except FileNotFoundError:
+                # Task dir removed, e.g. by a concurrent clear of the work dir
+                continue
+            for element_name in staged_element_names:
+                # A completed copy beats a running one, which beats a failed attempt that is being retried
+                if state == 'completed' or states.get(element_name) in (None, 'failed'):
+                    states[element_name] = state
+
+        completed = sum(1 for state in states.values() if state == 'completed')
+        failed = sum(1 for state in states.values() if state == 'failed')
+        running = sum(1 for state in states.values() if state == 'running')
+        elapsed_seconds = time.time() - self.start_time
+        elements_per_second = completed / elapsed_seconds if elapsed_seconds > 0 else 0.0
+        remaining = len(self.element_names) - completed
+
+        return {
+            'partition': self.partition,
+            'total': len(self.element_names),
+            'completed': completed,
+            'failed': failed,
+            'running': running,
+            'pending': remaining - failed - running,
+            'elapsed_seconds': elapsed_seconds,
+            'elements_per_second': elements_per_second,
+            'eta_seconds': remaining / elements_per_second if elements_per_second > 0 else None,
+        }
+
+    def report(self, final = False):
+        progress = self.get_progress()
+        if self.callback is not None:
+            try:
+                self.callback(progress)
+            except Exception as e:
+                logger.warn(f"Progress callback raised: {e}")
+        if self.progress_bar == 'lines':
+            # Several partitions share stderr, so each report gets its own line instead of redrawing one
+            sys.stderr.write(format_progress_bar(progress) + '\n')
+            sys.stderr.flush()
+        elif self.progress_bar:
+            sys.stderr.write('\r' + format_progress_bar(progress) + ('\n' if final else ''))
+            sys.stderr.flush()
+        return progress
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.report()
+
+    def stop(self):
+        """Stops the thread and sends one last report."""
+        self._stop_event.set()
+        self.join()
+        return self.report(final=True)
+
+
+class ProgressRelay(threading.Thread):
+    """
+    Background thread that calls `callback` in the driver with progress dicts from other processes.
+
+    When `partition` is a list, every partition runs in its own child process with its own ProgressMonitor. The
+    children put their progress dicts on `queue`, a `multiprocessing.Manager().Queue()`, so that the callback can see
+    and change driver-side state and does not have to be picklable.
+    """
+
+    def __init__(self, queue, callback):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.callback = callback
+
+    def run(self):
+        while True:
+            progress = self.queue.get()
+            if progress is None:
+                break
+            try:
+                self.callback(progress)
+            except Exception as e:
+                logger.warn(f"Progress callback raised: {e}")
+
+    def stop(self):
+        """Stops the thread once every progress dict already on the queue has been passed to the callback."""
+        self.queue.put(None)
+        self.join()
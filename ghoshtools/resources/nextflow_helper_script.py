@@ -23,16 +23,19 @@ def load_module_from_path(file_path):
     spec.loader.exec_module(module)
     return module
 
-def load_pickle_files_and_write_nextflow_script(pickled_func_file_path, pickled_obj_file_path, return_output):
+def load_func_from_path(pickled_func_file_path, func_name = None):
     module = load_module_from_path(pickled_func_file_path)
-    my_func_name = dir(module)[-1]
-    my_func = getattr(module, my_func_name, None)
-        
+    my_func_name = func_name if func_name else dir(module)[-1]
+    return getattr(module, my_func_name, None)
+
+def load_pickle_files_and_write_nextflow_script(my_func, pickled_obj_file_path, return_output):
     with open(pickled_obj_file_path, 'rb') as f:
         my_obj = pickle.load(f)
     
+    # Result files are prefixed with the name of the element file so they can be matched back to it
+    element_name = os.path.splitext(os.path.basename(pickled_obj_file_path))[0]
     current_dir = os.getcwd()
-    with tempfile.NamedTemporaryFile(delete=False, dir=current_dir, suffix='.pkl') as result_file_path:
+    with tempfile.NamedTemporaryFile(delete=False, dir=current_dir, prefix=f'{element_name}.', suffix='.pkl') as result_file_path:
         result = my_func(my_obj)
         
         if return_output:
@@ -44,12 +47,15 @@ def load_pickle_files_and_write_nextflow_script(pickled_func_file_path, pickled_
 def main():
     parser = argparse.ArgumentParser(description='Load pickle files and write nextflow script')
     parser.add_argument('--pickled_func_file_path', type=str, help='Path to the pickled function file')
-    parser.add_argument('--pickled_obj_file_path', type=str, help='Path to the pickled object file')
+    parser.add_argument('--pickled_obj_file_path', type=str, nargs='+', help='Path(s) to the pickled object file(s). The function is loaded once and run on each.')
     parser.add_argument('--return_output', type=str2bool, help='True if user wants output, false if not.')
+    parser.add_argument('--func_name', type=str, default=None, help='Name of the function to run. Defaults to the last name in the module.')
     args = parser.parse_args()
     
-    result_file_path = load_pickle_files_and_write_nextflow_script(args.pickled_func_file_path, args.pickled_obj_file_path, args.return_output)
-    print(result_file_path)
+    my_func = load_func_from_path(args.pickled_func_file_path, args.func_name)
+    for pickled_obj_file_path in args.pickled_obj_file_path:
+        result_file_path = load_pickle_files_and_write_nextflow_script(my_func, pickled_obj_file_path, args.return_output)
+        print(result_file_path)
     
 
 if __name__ == '__main__':
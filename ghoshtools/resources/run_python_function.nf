@@ -4,6 +4,7 @@ nextflow.enable.dsl=2
 
 params.file_path = '' // Default empty, expecting user to provide
 params.dir_path = '' // Default empty, expecting user to provide
+params.func_name = '' // Default empty, helper script picks the function from the module
 
 // Validate parameters
 if (params.file_path.trim() == '') {
@@ -29,7 +30,7 @@ process RunPythonFunc {
     conda activate poop
 
     # Execute the constructed commands in parallel
-    python ${params.python_path} --pickled_func_file_path ${params.file_path} --pickled_obj_file_path ${dir_file} --return_output ${params.return_output}
+    python ${params.python_path} --pickled_func_file_path ${params.file_path} --pickled_obj_file_path ${dir_file} --return_output ${params.return_output} ${params.func_name ? "--func_name ${params.func_name}" : ''}
     """
 }
 
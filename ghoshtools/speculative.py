@@ -0,0 +1,161 @@
+"""Speculative re-execution of straggler Nextflow tasks."""
+
+import os
+import re
+import glob
+import time
+import signal
+import shutil
+import logging
+import tempfile
+import statistics
+import subprocess
+from collections import OrderedDict
+
+from ghoshtools import GT_GLOBALS
+
+logger = logging.getLogger('ghoshtools')
+
+
+def get_task_state(task_dir):
+    """
+    Reads the state of a Nextflow task from the marker files its wrapper script writes.
+
+    :param task_dir: Nextflow task work dir.
+    :return: Tuple of ('completed' | 'failed' | 'running', seconds since the task began or its total runtime).
+    """
+    begin_time = os.path.getmtime(os.path.join(task_dir, '.command.begin'))
+    exitcode_path = os.path.join(task_dir, '.exitcode')
+
+    if os.path.exists(exitcode_path):
+        with open(exitcode_path, 'r') as f:
+            exitcode = f.read().strip()
+        if exitcode:
+            state = 'completed' if exitcode == '0' else 'failed'
+            return state, os.path.getmtime(exitcode_path) - begin_time
+
+    return 'running', time.time() - begin_time
+
+
+def update_task_dir_elements(work_dir_path, element_names, task_dir_elements):
+    """
+    Records which element files each started task dir under `work_dir_path` processes. Batched tasks process several.
+
+    Element names are read from the task's `.command.sh`, which Nextflow writes before submitting the task. The staged
+    input symlinks are not used because a task dir scanned while they are still being created would miss elements.
+    """
+    for task_dir in glob.glob(os.path.join(work_dir_path, '*', '*')):
+        if task_dir in task_dir_elements or not os.path.exists(os.path.join(task_dir, '.command.begin')):
+            continue
+        try:
+            with open(os.path.join(task_dir, '.command.sh'), 'r') as f:
+                command = f.read()
+        except FileNotFoundError:
+            continue
+        task_element_names = [os.path.basename(path) for path in re.findall(r'\S+\.pkl\b', command) if os.path.basename(path) in element_names]
+        if task_element_names:
+            task_dir_elements[task_dir] = list(OrderedDict.fromkeys(task_element_names))
+    return task_dir_elements
+
+
+def kill_process_group(process):
+    if process.poll() is None:
+        try:
+            # Nextflow cancels its own cluster jobs on SIGTERM
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            # Exited between poll and kill
+            pass
+        process.wait()
+
+
+def run_nextflow_speculatively(nextflow_cmd, element_file_paths, work_dir_path, make_speculative_cmd, completed_fraction = 0.75, straggler_multiplier = 2.0, poll_interval = 30):
+    """
+    Runs a Nextflow command and launches duplicates of straggler tasks once most elements are done.
+
+    A running task is a straggler when it has been running for longer than `straggler_multiplier` times the median
+    runtime of completed tasks. Stragglers are copied into a new directory and run again by a second Nextflow command.
+    Whichever copy of an element finishes first is kept, and all Nextflow runs still going are killed once every
+    element has a result.
+
+    :param nextflow_cmd: Nextflow command for the full run.
+    :param element_file_paths: Pickled element files the full run will process.
+    :param work_dir_path: Nextflow work dir of the full run.
+    :param make_speculative_cmd: Callable taking (dir_path, work_dir_path, wave) and returning the Nextflow command
+                                 that reruns the element files in dir_path.
+    :param completed_fraction: Fraction of elements that must be complete before stragglers are duplicated.
+    :param straggler_multiplier: Multiple of the median completed runtime after which a task counts as a straggler.
+    :param poll_interval: Seconds between checks of the work dirs.
+    :return: A list of the winning task dirs, in the same order as `element_file_paths`.
+    """
+    element_names = {os.path.basename(element_file_path): element_file_path for element_file_path in element_file_paths}
+    speculative_work_dir_path = os.path.join(work_dir_path, 'speculative')
+    work_dir_paths = [work_dir_path, speculative_work_dir_path]
+
+    processes = [subprocess.Popen(nextflow_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)]
+    speculated = set()
+    speculative_dir_paths = []
+    task_dir_elements = {}
+
+    try:
+        while True:
+            all_exited = all(process.poll() is not None for process in processes)
+
+            for path in work_dir_paths:
+                update_task_dir_elements(path, element_names, task_dir_elements)
+
+            winners = {}
+            finish_times = {}
+            durations = []
+            running = {}
+            for task_dir, staged_element_names in task_dir_elements.items():
+                try:
+                    state, elapsed = get_task_state(task_dir)
+                    finish_time = os.path.getmtime(os.path.join(task_dir, '.exitcode')) if state == 'completed' else None
+                except FileNotFoundError:
+                    # Task dir removed, e.g. by a concurrent clear of the work dir
+                    continue
+                if state == 'completed':
+                    durations.append(elapsed)
+                for element_name in staged_element_names:
+                    if state == 'completed':
+                        # Keep the copy that finished first, not the first one found
+                        if element_name not in winners or finish_time < finish_times[element_name]:
+                            winners[element_name] = task_dir
+                            finish_times[element_name] = finish_time
+                    elif state == 'running':
+                        running[element_name] = max(running.get(element_name, 0), elapsed)
+
+            if len(winners) == len(element_names):
+                break
+
+            if all_exited:
+                returncode = processes[0].returncode
+                logger.error("Nextflow exited with %d of %d elements complete", len(winners), len(element_names))
+                raise subprocess.CalledProcessError(returncode if returncode else 1, nextflow_cmd)
+
+            if durations and len(winners) >= completed_fraction * len(element_names):
+                threshold = statistics.median(durations) * straggler_multiplier
+                stragglers = [name for name, elapsed in running.items() if name not in winners and name not in speculated and elapsed > threshold]
+
+                if stragglers:
+                    speculative_dir_path = tempfile.mkdtemp(dir=GT_GLOBALS.SCRATCH_DIR)
+                    speculative_dir_paths.append(speculative_dir_path)
+                    for name in stragglers:
+                        os.symlink(element_names[name], os.path.join(speculative_dir_path, name))
+                    speculated.update(stragglers)
+
+                    speculative_cmd = make_speculative_cmd(speculative_dir_path, speculative_work_dir_path, len(speculative_dir_paths))
+                    processes.append(subprocess.Popen(speculative_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True))
+                    logger.info("Launched %d speculative duplicates of tasks running longer than %.1fs (median %.1fs)", len(stragglers), threshold, statistics.median(durations))
+
+            time.sleep(poll_interval)
+    finally:
+        for process in processes:
+            kill_process_group(process)
+        for speculative_dir_path in speculative_dir_paths:
+            shutil.rmtree(speculative_dir_path, ignore_errors=True)
+
+    speculative_wins = sum(1 for task_dir in winners.values() if task_dir.startswith(speculative_work_dir_path))
+    logger.info("All %d elements complete. %d of %d speculative duplicates finished first", len(winners), speculative_wins, len(speculated))
+    return [winners[os.path.basename(element_file_path)] for element_file_path in element_file_paths]
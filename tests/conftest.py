@@ -0,0 +1,29 @@
+import pytest
+
+import ghoshtools as gt
+
+
+@pytest.fixture
+def scratch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gt.GT_GLOBALS, 'SCRATCH_DIR', str(tmp_path))
+    return tmp_path
+
+def create_task_dir(work_dir_path, task_hash, element_names, exitcode = None, started = True, staged_element_names = None):
+    """Fakes a Nextflow task dir whose .command.sh runs the helper script on `element_names`."""
+    task_dir = work_dir_path / task_hash[:2] / task_hash[2:]
+    task_dir.mkdir(parents=True)
+    (task_dir / '.command.sh').write_text(
+        f"#!/bin/bash -ue\nml miniconda\nconda activate poop\n"
+        f"python /resources/nextflow_helper_script.py --pickled_func_file_path /scratch/func.py --pickled_obj_file_path {' '.join(element_names)} --return_output true\n"
+    )
+    for element_name in element_names if staged_element_names is None else staged_element_names:
+        (task_dir / element_name).write_bytes(b'')
+    if started:
+        (task_dir / '.command.begin').write_text('')
+    if exitcode is not None:
+        (task_dir / '.exitcode').write_text(exitcode)
+    return str(task_dir)
+
+@pytest.fixture
+def make_task_dir():
+    return create_task_dir
@@ -0,0 +1,96 @@
+import os
+from importlib import resources
+
+import pytest
+
+import ghoshtools as gt
+from ghoshtools import calibration
+from ghoshtools.calibration import (
+    MAX_TASK_SECONDS,
+    MIN_NUM_TASKS,
+    CALIBRATION_CACHE_FILE_NAME,
+    calibrate_batch_size,
+    choose_batch_size,
+    load_calibration_cache,
+    save_calibration_cache,
+)
+from ghoshtools.ghoshtools import pickle_dump_iterable
+
+
+def write_pilot_inputs(scratch_dir, func_body):
+    func_file_path = scratch_dir / 'func.py'
+    func_file_path.write_text(f"def pilot_func(x):\n    {func_body}\n")
+    elements_dir_path = scratch_dir / 'elements'
+    elements_dir_path.mkdir()
+    element_file_paths = [pickle_dump_iterable(x, str(elements_dir_path)) for x in range(5)]
+    return str(func_file_path), element_file_paths
+
+def test_choose_batch_size_amortizes_overhead():
+    # 9s overhead is 10% of a task once it holds 81s of 1s elements
+    batch_size, reason = choose_batch_size(10 ** 6, 1.0, 9.0)
+    assert batch_size == 81
+    assert 'needs 81' in reason
+
+def test_choose_batch_size_keeps_min_num_tasks():
+    batch_size, _ = choose_batch_size(500, 0.3, 60.0)
+    assert batch_size == 500 // MIN_NUM_TASKS
+
+    # Fewer elements than MIN_NUM_TASKS means one element per task
+    assert choose_batch_size(MIN_NUM_TASKS - 1, 0.01, 60.0)[0] == 1
+
+def test_choose_batch_size_stays_under_max_task_seconds():
+    batch_size, _ = choose_batch_size(10 ** 6, 1000.0, 2000.0)
+    assert batch_size == (MAX_TASK_SECONDS - 2000) // 1000
+    assert batch_size * 1000.0 + 2000.0 <= MAX_TASK_SECONDS
+
+def test_choose_batch_size_floors_untimeable_elements():
+    assert choose_batch_size(10 ** 7, 0.0, 1.0) == choose_batch_size(10 ** 7, 1e-3, 1.0)
+    assert choose_batch_size(10 ** 7, 0.0, 1.0)[0] > 1
+
+def test_calibration_cache_round_trip(tmp_path):
+    cache_file_path = str(tmp_path / CALIBRATION_CACHE_FILE_NAME)
+    assert load_calibration_cache(cache_file_path) == {}
+
+    cache = {'abc': {'per_element_seconds': 1.5, 'startup_seconds': 0.2}}
+    save_calibration_cache(cache_file_path, cache)
+    assert load_calibration_cache(cache_file_path) == cache
+    assert os.listdir(tmp_path) == [CALIBRATION_CACHE_FILE_NAME]
+
+def test_calibration_cache_unreadable(tmp_path):
+    cache_file_path = tmp_path / CALIBRATION_CACHE_FILE_NAME
+    cache_file_path.write_text('{"abc": ')
+    assert load_calibration_cache(str(cache_file_path)) == {}
+
+def test_calibrate_batch_size_caches_pilot(scratch_dir, monkeypatch):
+    func_file_path, element_file_paths = write_pilot_inputs(scratch_dir, 'return x + 1')
+    with resources.path('ghoshtools.resources', 'nextflow_helper_script.py') as python_script_file_path:
+        batch_size = calibrate_batch_size(python_script_file_path, func_file_path, ' --func_name pilot_func', element_file_paths, 'day')
+        assert batch_size == 1
+        assert len(load_calibration_cache(str(scratch_dir / CALIBRATION_CACHE_FILE_NAME))) == 1
+
+        # A second call must reuse the cached measurements instead of running the pilot again
+        def fail_pilot(*args, **kwargs):
+            raise AssertionError("pilot ran despite a cached calibration")
+        monkeypatch.setattr(calibration, 'time_local_pilot', fail_pilot)
+        assert calibrate_batch_size(python_script_file_path, func_file_path, ' --func_name pilot_func', element_file_paths, 'day') == batch_size
+
+def test_calibrate_batch_size_falls_back_on_error(scratch_dir, caplog):
+    func_file_path, element_file_paths = write_pilot_inputs(scratch_dir, "raise RuntimeError('pilot exploded')")
+    with resources.path('ghoshtools.resources', 'nextflow_helper_script.py') as python_script_file_path:
+        batch_size = calibrate_batch_size(python_script_file_path, func_file_path, ' --func_name pilot_func', element_file_paths, 'day')
+
+    assert batch_size is None
+    assert 'pilot exploded' in caplog.text
+    assert not os.path.exists(scratch_dir / CALIBRATION_CACHE_FILE_NAME)
+
+def test_calibrate_batch_size_falls_back_on_timeout(scratch_dir):
+    func_file_path, element_file_paths = write_pilot_inputs(scratch_dir, 'import time; time.sleep(60)')
+    with resources.path('ghoshtools.resources', 'nextflow_helper_script.py') as python_script_file_path:
+        batch_size = calibrate_batch_size(python_script_file_path, func_file_path, ' --func_name pilot_func', element_file_paths, 'day', pilot_timeout=1)
+
+    assert batch_size is None
+
+@pytest.mark.parametrize('batch_size', [True, 0, -1, 2.5, 'big'])
+def test_run_func_with_nextflow_rejects_bad_batch_size(batch_size):
+    with pytest.raises(ValueError):
+        gt.run_func_with_nextflow(abs, [1], None, batch_size=batch_size)
@@ -0,0 +1,71 @@
+import pytest
+
+from ghoshtools.ghoshtools import dedupe_iterable, order_result_file_paths
+
+
+def test_dedupe_iterable():
+    unique_elements, positions = dedupe_iterable([('chr1', 10), 'b', ('chr1', 10), {'k': 1}, 'b', {'k': 1}])
+
+    assert unique_elements == [('chr1', 10), 'b', {'k': 1}]
+    assert positions == [0, 1, 0, 2, 1, 2]
+    assert [unique_elements[position] for position in positions] == [('chr1', 10), 'b', ('chr1', 10), {'k': 1}, 'b', {'k': 1}]
+
+def test_dedupe_iterable_empty():
+    assert dedupe_iterable([]) == ([], [])
+
+def test_order_result_file_paths():
+    element_file_paths = ['/scratch/tmpaaa.pkl', '/scratch/tmpbbb.pkl', '/scratch/tmpccc.pkl']
+    result_file_paths = ['/work/12/34/tmpccc.tmp1.pkl', '/work/56/78/tmpaaa.tmp2.pkl', '/work/9a/bc/tmpbbb.tmp3.pkl']
+
+    assert order_result_file_paths(result_file_paths, element_file_paths) == [
+        '/work/56/78/tmpaaa.tmp2.pkl',
+        '/work/9a/bc/tmpbbb.tmp3.pkl',
+        '/work/12/34/tmpccc.tmp1.pkl',
+    ]
+
+def test_order_result_file_paths_missing_result():
+    element_file_paths = ['/scratch/tmpaaa.pkl', '/scratch/tmpbbb.pkl']
+
+    with pytest.raises(RuntimeError, match='tmpbbb'):
+        order_result_file_paths(['/work/56/78/tmpaaa.tmp2.pkl'], element_file_paths)
+
+def test_dedupe_rejects_misaligned_results(monkeypatch):
+    from ghoshtools import ghoshtools
+    run_func_with_nextflow = ghoshtools.run_func_with_nextflow
+    # The split keeps both unique elements, but the inner dispatch still loses one result
+    monkeypatch.setattr(ghoshtools, 'run_func_with_nextflow', lambda *args, **kwargs: [[1], []])
+
+    with pytest.raises(RuntimeError):
+        run_func_with_nextflow(abs, [1, 2, 1], None, partition=['bigmem', 'scavenge'], dedupe=True)
+
+def test_dedupe_fans_out_results(monkeypatch):
+    from ghoshtools import ghoshtools
+    run_func_with_nextflow = ghoshtools.run_func_with_nextflow
+    monkeypatch.setattr(ghoshtools, 'run_func_with_nextflow', lambda my_func, my_iterable, *args, **kwargs: [x * 10 for x in my_iterable])
+
+    assert run_func_with_nextflow(abs, [1, 2, 1, 3, 2], None, dedupe=True) == [10, 20, 10, 30, 20]
+
+def test_dedupe_fanned_out_results_are_independent(monkeypatch):
+    from ghoshtools import ghoshtools
+    run_func_with_nextflow = ghoshtools.run_func_with_nextflow
+    monkeypatch.setattr(ghoshtools, 'run_func_with_nextflow', lambda my_func, my_iterable, *args, **kwargs: [[x] for x in my_iterable])
+
+    results = run_func_with_nextflow(abs, [1, 2, 1, 1], None, dedupe=True)
+    results[0].append('changed')
+
+    assert results == [[1, 'changed'], [2], [1], [1]]
+
+def test_dedupe_rejects_dropping_partition_split_before_dispatch(monkeypatch):
+    from ghoshtools import ghoshtools
+    run_func_with_nextflow = ghoshtools.run_func_with_nextflow
+
+    def fail_dispatch(*args, **kwargs):
+        raise AssertionError("Nothing should be dispatched")
+    monkeypatch.setattr(ghoshtools, 'run_func_with_nextflow', fail_dispatch)
+
+    # One element split by weight across three partitions rounds down to nothing everywhere
+    with pytest.raises(ValueError):
+        run_func_with_nextflow(abs, [1, 1], None, partition=['bigmem', 'ycga_bigmem', 'scavenge'], dedupe=True)
+    # No partition has a weighting
+    with pytest.raises(ValueError):
+        run_func_with_nextflow(abs, [1, 2], None, partition=['day'], dedupe=True)
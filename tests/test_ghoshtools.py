@@ -7,14 +7,69 @@ def my_func(x):
     time.sleep(10)
     return x
     
+def is_even(x):
+    return x % 2 == 0
+    
 def test_one():    
     my_iterable = list(range(5))
     results = gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log')
     pprint(results)
     return
 
+def test_pipeline():
+    my_iterable = list(range(5))
+    results = gt.pipeline(my_func).filter(is_even).map(my_func).run(my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log')
+    pprint(results)
+    assert results == [0, 16, 256]
+    return
+
+def test_speculative():
+    my_iterable = list(range(5))
+    results = gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log', speculative = True, speculative_partition = 'scavenge')
+    pprint(results)
+    assert results == [x**2 for x in my_iterable]
+    return
+
+def test_progress():
+    my_iterable = list(range(5))
+    progress = []
+    results = gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log', progress_callback = progress.append, progress_bar = True)
+    pprint(results)
+    pprint(progress[-1])
+    assert progress[-1]['completed'] == progress[-1]['total'] == 5
+    assert progress[-1]['failed'] == 0
+    return
+
+def test_progress_partitions():
+    my_iterable = list(range(6))
+    partition = ['bigmem', 'scavenge']
+    progress = []
+    gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log', partition = partition, progress_callback = progress.append)
+    assert {report['partition'] for report in progress} == set(partition)
+    return
+
+def test_dedupe():
+    my_iterable = [1, 2, 1, 3, 2, 1]
+    results = gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log', dedupe = True)
+    pprint(results)
+    assert results == [x**2 for x in my_iterable]
+    return
+
+def test_auto_batch_size():
+    my_iterable = list(range(5))
+    results = gt.run_func_with_nextflow(my_func, my_iterable, log_file_path = '/home/rg972/project/Poop/nextflow_poop.log', batch_size = 'auto')
+    pprint(results)
+    assert results == [x**2 for x in my_iterable]
+    return
+
 def main():
     test_one()
+    test_pipeline()
+    test_speculative()
+    test_progress()
+    test_progress_partitions()
+    test_dedupe()
+    test_auto_batch_size()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
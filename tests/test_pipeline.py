@@ -0,0 +1,59 @@
+import importlib.util
+
+import pytest
+
+import ghoshtools as gt
+from ghoshtools.pipeline import FusedStages, WORKER_FUNC_NAME
+
+
+def square(x):
+    return x * x
+
+def is_even(x):
+    return x % 2 == 0
+
+def add(a, b):
+    return a + b
+
+def load_module(file_path):
+    spec = importlib.util.spec_from_file_location('gt_test_module', file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_split_stages_at_boundaries():
+    segments = gt.pipeline(square).filter(is_even).group_by(is_even).map(square).reduce(add).split_stages()
+
+    assert [type(segment) for segment in segments] == [FusedStages, tuple, FusedStages, tuple]
+    assert segments[0].stages == [('map', square), ('filter', is_even)]
+    assert segments[1] == ('group_by', is_even)
+    assert segments[2].stages == [('map', square)]
+    assert segments[3][:2] == ('reduce', add)
+
+def test_no_stages_after_reduce():
+    with pytest.raises(ValueError):
+        gt.pipeline(square).reduce(add).map(square)
+
+def test_write_worker_module(scratch_dir):
+    worker_file_path = scratch_dir / 'worker.py'
+    func_name = gt.pipeline(square).filter(is_even).map(square).split_stages()[0].write_worker_module(str(worker_file_path))
+
+    worker = getattr(load_module(worker_file_path), func_name)
+    assert func_name == WORKER_FUNC_NAME
+    assert [worker(x) for x in range(3)] == [[0], [], [16]]
+
+def test_write_worker_module_rejects_name_collision(scratch_dir):
+    other_file_path = scratch_dir / 'other_stages.py'
+    other_file_path.write_text("def square(x):\n    return -x\n")
+    other_square = load_module(other_file_path).square
+
+    with pytest.raises(ValueError):
+        FusedStages([('map', square), ('map', other_square)]).write_worker_module(str(scratch_dir / 'worker.py'))
+
+def test_write_worker_module_rejects_lambda(scratch_dir):
+    with pytest.raises(ValueError):
+        FusedStages([('map', lambda x: x)]).write_worker_module(str(scratch_dir / 'worker.py'))
+
+def test_reduce_with_none_initial():
+    assert gt.Pipeline().reduce(lambda acc, x: [acc, x], None).run([1], log_file_path = None) == [None, 1]
+    assert gt.Pipeline().reduce(add).run([1, 2, 3], log_file_path = None) == 6
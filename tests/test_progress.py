@@ -0,0 +1,69 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ghoshtools.progress import ProgressMonitor, ProgressRelay, format_progress_bar, format_seconds
+
+
+def test_get_progress(tmp_path, make_task_dir):
+    element_file_paths = [f'/scratch/e{i}.pkl' for i in range(5)]
+    make_task_dir(tmp_path, 'aa0001', ['e0.pkl'], exitcode='0')
+    # Failed attempt that was retried successfully counts once, as completed
+    make_task_dir(tmp_path, 'aa0002', ['e1.pkl'], exitcode='1')
+    make_task_dir(tmp_path, 'aa0003', ['e1.pkl'], exitcode='0')
+    make_task_dir(tmp_path, 'aa0004', ['e2.pkl'], exitcode='1')
+    make_task_dir(tmp_path, 'aa0005', ['e3.pkl'])
+    # Speculative duplicate of a running element
+    make_task_dir(tmp_path / 'speculative', 'bb0001', ['e3.pkl'])
+
+    progress = ProgressMonitor(element_file_paths, str(tmp_path), 'day').get_progress()
+
+    assert progress['partition'] == 'day'
+    assert progress['total'] == 5
+    assert progress['completed'] == 2
+    assert progress['failed'] == 1
+    assert progress['running'] == 1
+    assert progress['pending'] == 1
+    assert progress['elements_per_second'] > 0
+    assert progress['eta_seconds'] > 0
+
+def test_report_lines(tmp_path, capsys):
+    reports = []
+    monitor = ProgressMonitor(['/scratch/e0.pkl'], str(tmp_path), 'bigmem', callback=reports.append, progress_bar='lines')
+    monitor.report()
+    monitor.report()
+
+    assert len(reports) == 2
+    assert capsys.readouterr().err.count('\n') == 2
+
+def test_format_seconds():
+    assert format_seconds(None) == '?'
+    assert format_seconds(59.9) == '0m59s'
+    assert format_seconds(61) == '1m01s'
+    assert format_seconds(3 * 3600 + 5 * 60 + 7) == '3h05m07s'
+
+def test_format_progress_bar():
+    progress = {'partition': 'day', 'total': 4, 'completed': 2, 'failed': 1, 'running': 1, 'elements_per_second': 0.5, 'eta_seconds': 4}
+    bar = format_progress_bar(progress)
+
+    assert bar.startswith('[day] [' + '#' * 15 + '.' * 15 + ']')
+    assert '2/4 completed, 1 failed, 1 running | 0.50 el/s | ETA 0m04s' in bar
+
+def report_partition_progress(partition, callback):
+    callback({'partition': partition, 'completed': 1})
+    return partition
+
+def test_progress_relay_calls_callback_in_driver():
+    reports = []
+    manager = multiprocessing.Manager()
+    progress_queue = manager.Queue()
+    # A lambda could not be sent to the child processes, but it never has to be
+    relay = ProgressRelay(progress_queue, lambda progress: reports.append(progress))
+    relay.start()
+
+    with ProcessPoolExecutor() as executor:
+        partitions = list(executor.map(report_partition_progress, ['bigmem', 'scavenge'], [progress_queue.put] * 2))
+    relay.stop()
+    manager.shutdown()
+
+    assert partitions == ['bigmem', 'scavenge']
+    assert sorted(progress['partition'] for progress in reports) == ['bigmem', 'scavenge']
@@ -0,0 +1,57 @@
+import os
+import subprocess
+
+from ghoshtools.speculative import get_task_state, update_task_dir_elements, kill_process_group, run_nextflow_speculatively
+
+
+def test_get_task_state(tmp_path, make_task_dir):
+    completed_dir = make_task_dir(tmp_path, 'aa0001', ['a.pkl'], exitcode='0')
+    failed_dir = make_task_dir(tmp_path, 'aa0002', ['b.pkl'], exitcode='1')
+    running_dir = make_task_dir(tmp_path, 'aa0003', ['c.pkl'])
+    # .exitcode exists but has not been written yet
+    writing_dir = make_task_dir(tmp_path, 'aa0004', ['d.pkl'], exitcode='')
+
+    assert get_task_state(completed_dir)[0] == 'completed'
+    assert get_task_state(failed_dir)[0] == 'failed'
+    assert get_task_state(running_dir)[0] == 'running'
+    assert get_task_state(writing_dir)[0] == 'running'
+    assert get_task_state(running_dir)[1] >= 0
+
+def test_update_task_dir_elements(tmp_path, make_task_dir):
+    single_dir = make_task_dir(tmp_path, 'bb0001', ['a.pkl'])
+    batch_dir = make_task_dir(tmp_path, 'bb0002', ['b.pkl', 'c.pkl'])
+    make_task_dir(tmp_path, 'bb0003', ['d.pkl'], started=False)
+    make_task_dir(tmp_path, 'bb0004', ['other.pkl'])
+
+    task_dir_elements = update_task_dir_elements(str(tmp_path), {'a.pkl', 'b.pkl', 'c.pkl', 'd.pkl'}, {})
+
+    assert set(task_dir_elements) == {single_dir, batch_dir}
+    assert task_dir_elements[single_dir] == ['a.pkl']
+    assert sorted(task_dir_elements[batch_dir]) == ['b.pkl', 'c.pkl']
+
+def test_kill_process_group():
+    process = subprocess.Popen('sleep 60', shell=True, start_new_session=True)
+    kill_process_group(process)
+    assert process.poll() is not None
+    # Already exited
+    kill_process_group(process)
+
+def test_update_task_dir_elements_partly_staged(tmp_path, make_task_dir):
+    # Task already began but only one of its inputs has been symlinked so far
+    batch_dir = make_task_dir(tmp_path, 'cc0001', ['a.pkl', 'b.pkl', 'c.pkl'], staged_element_names=['a.pkl'])
+
+    task_dir_elements = update_task_dir_elements(str(tmp_path), {'a.pkl', 'b.pkl', 'c.pkl'}, {})
+
+    assert task_dir_elements == {batch_dir: ['a.pkl', 'b.pkl', 'c.pkl']}
+
+def test_run_nextflow_speculatively_keeps_first_finished_copy(tmp_path, make_task_dir, scratch_dir):
+    work_dir_path = tmp_path / 'work'
+    original_dir = make_task_dir(work_dir_path, 'dd0001', ['a.pkl', 'b.pkl'], exitcode='0')
+    speculative_dir = make_task_dir(work_dir_path / 'speculative', 'ee0001', ['b.pkl'], exitcode='0')
+    # Both copies of b.pkl are done by the first poll, but the speculative one finished earlier
+    os.utime(os.path.join(speculative_dir, '.exitcode'), (1000, 1000))
+    os.utime(os.path.join(original_dir, '.exitcode'), (2000, 2000))
+
+    task_dirs = run_nextflow_speculatively('true', ['/scratch/a.pkl', '/scratch/b.pkl'], str(work_dir_path), None, poll_interval=0)
+
+    assert task_dirs == [original_dir, speculative_dir]